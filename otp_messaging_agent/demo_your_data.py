@@ -24,15 +24,17 @@ time.sleep(6)
 
 # Show results
 metrics = agent.get_metrics()
+runtime = metrics['runtime_metrics']
+db_stats = metrics['database_stats']
 print("\n📊 Processing Results:")
-print(f"  Messages sent: {metrics['runtime_metrics']['total_sent']}")
-print(f"  Messages delivered: {metrics['runtime_metrics']['total_delivered']}")
-print(f"  Success rate: {metrics['database_stats']['success_rate']}")
+print(f"  Messages sent: {runtime['total_sent']}")
+print(f"  Messages delivered: {runtime['total_delivered']}")
+print(f"  Success rate: {db_stats['success_rate']}")
 print(f"  Queue size: {metrics['queue_size']}")
 
 # Show channel distribution
 print("\n📱 Channel Usage:")
-for channel, stats in metrics['runtime_metrics']['channel_stats'].items():
+for channel, stats in runtime['channel_stats'].items():
     if stats['sent'] > 0:
         print(f"  {channel}: {stats['sent']} sent, {stats['delivered']} delivered")
 
@@ -6,6 +6,8 @@ Shows how to integrate the Intelligent OTP Agent with external systems
 import json
 import time
 import threading
+from collections import deque
+from functools import partial
 from datetime import datetime, timedelta
 from typing import Dict, Any, List
 
@@ -13,14 +15,30 @@ from typing import Dict, Any, List
 class ExternalSystemIntegrations:
     """Simulates integration with various external systems."""
     
+    # Submission ring owned by each monitor thread
+    REGISTRATION_RING = 0
+    ORDER_RING = 1
+    SECURITY_RING = 2
+    PAYMENT_RING = 3
+    
     def __init__(self, otp_agent):
         self.otp_agent = otp_agent
         self.running = False
+        
+        # One single-producer ring per monitor, drained by one consumer thread,
+        # so the monitors never contend with each other on the agent's queue
+        self._rings = [deque() for _ in range(4)]
+        self._pending = threading.Event()  # Set by _submit (and on stop) to wake the drain thread
+        self._drain_thread = None
     
     def start_integrations(self):
         """Start all integration services."""
         self.running = True
         
+        # Start the consumer before the producers
+        self._drain_thread = threading.Thread(target=self._drain_rings, daemon=True)
+        self._drain_thread.start()
+        
         # Start various integration threads
         threading.Thread(target=self.user_registration_monitor, daemon=True).start()
         threading.Thread(target=self.order_system_integration, daemon=True).start()
@@ -32,8 +50,31 @@ class ExternalSystemIntegrations:
     def stop_integrations(self):
         """Stop all integration services."""
         self.running = False
+        self._pending.set()
+        if self._drain_thread:
+            self._drain_thread.join(timeout=5)
         print("⏹️ External system integrations stopped")
     
+    def _submit(self, ring: int, send, *args, **kwargs):
+        """Queue an agent call on a monitor's ring (deque.append is thread-safe)."""
+        self._rings[ring].append(partial(send, *args, **kwargs))
+        self._pending.set()
+    
+    def _drain_rings(self):
+        """Forward queued submissions from every ring to the agent."""
+        while self.running or any(self._rings):
+            # Sleep until something is submitted; clearing before the drain means
+            # a submission that lands mid-drain sets the event again, so none is missed
+            self._pending.wait()
+            self._pending.clear()
+            for ring in self._rings:
+                while ring:
+                    send = ring.popleft()
+                    try:
+                        send()
+                    except Exception as e:
+                        print(f"❌ Error submitting message to agent: {e}")
+    
     def user_registration_monitor(self):
         """Monitor user registrations and send welcome messages."""
         while self.running:
@@ -43,7 +84,9 @@ class ExternalSystemIntegrations:
                 
                 for user in new_users:
                     # Send welcome OTP
-                    self.otp_agent.send_otp(
+                    self._submit(
+                        self.REGISTRATION_RING,
+                        self.otp_agent.send_otp,
                         phone_number=user['phone'],
                         user_id=user['user_id']
                     )
@@ -58,7 +101,7 @@ class ExternalSystemIntegrations:
                         preferred_channel='WhatsApp',
                         user_id=user['user_id']
                     )
-                    self.otp_agent.send_message(welcome_msg)
+                    self._submit(self.REGISTRATION_RING, self.otp_agent.send_message, welcome_msg)
                     
                     print(f"📝 Processed new user registration: {user['name']}")
                 
@@ -101,7 +144,7 @@ class ExternalSystemIntegrations:
                         preferred_channel=channel,
                         user_id=order['customer_id']
                     )
-                    self.otp_agent.send_message(order_msg)
+                    self._submit(self.ORDER_RING, self.otp_agent.send_message, order_msg)
                     
                     print(f"📦 Sent order update for #{order['order_id']}: {order['status']}")
                 
@@ -144,7 +187,7 @@ class ExternalSystemIntegrations:
                         preferred_channel=channel,
                         user_id=event['user_id']
                     )
-                    self.otp_agent.send_message(security_msg)
+                    self._submit(self.SECURITY_RING, self.otp_agent.send_message, security_msg)
                     
                     print(f"🚨 Sent security alert for user {event['user_id']}: {event['type']}")
                 
@@ -184,7 +227,7 @@ class ExternalSystemIntegrations:
                         preferred_channel='SMS',
                         user_id=payment['customer_id']
                     )
-                    self.otp_agent.send_message(payment_msg)
+                    self._submit(self.PAYMENT_RING, self.otp_agent.send_message, payment_msg)
                     
                     print(f"💳 Sent payment notification for transaction {payment['transaction_id']}: {payment['status']}")
                 
@@ -298,10 +341,12 @@ def demo_enterprise_integration():
         # Show final metrics
         print("\n📊 Final System Metrics:")
         metrics = agent.get_metrics()
-        print(f"  Total messages processed: {metrics['runtime_metrics']['total_sent']}")
-        print(f"  Success rate: {metrics['database_stats']['success_rate']}")
+        runtime = metrics['runtime_metrics']
+        db_stats = metrics['database_stats']
+        print(f"  Total messages processed: {runtime['total_sent']}")
+        print(f"  Success rate: {db_stats['success_rate']}")
         print(f"  Channel distribution:")
-        for channel, stats in metrics['runtime_metrics']['channel_stats'].items():
+        for channel, stats in runtime['channel_stats'].items():
             if stats['sent'] > 0:
                 print(f"    {channel}: {stats['sent']} sent, {stats['delivered']} delivered")
         
@@ -5,12 +5,60 @@ Provides live metrics, alerts, and performance monitoring
 
 import time
 import json
+import bisect
+import math
+import sys
 import sqlite3
+from collections import deque
+from contextlib import closing
+from itertools import islice
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import threading
 from otp_messaging_agent import IntelligentOTPAgent
 
+try:
+    import orjson  # Optional: much faster JSON encoding for exports
+except ImportError:
+    orjson = None
+
+# Dashboard layout, formatted once per tick with str.format_map
+DASHBOARD_TEMPLATE = """\
+🤖 INTELLIGENT OTP AGENT - MONITORING DASHBOARD
+============================================================
+📅 {now}
+🟢 Agent Status: {status}
+
+📊 CORE METRICS
+------------------------------
+Total Messages Sent: {total_sent:,}
+Total Delivered: {total_delivered:,}
+Total Failed: {total_failed:,}
+Success Rate: {success_rate:.1%}
+Queue Size: {queue_size}
+Avg Processing Time: {avg_processing_time:.2f}s
+Messages/Minute: {messages_per_minute:.1f}
+
+📱 CHANNEL PERFORMANCE
+------------------------------
+{channels}
+
+{recent_activity}{alerts}🔄 Next update in {interval} seconds..."""
+
+CHANNEL_TEMPLATE = "{channel:10} | Success: {success_rate:.1%} | Sent: {total_sent:,}"
+
+RECENT_ACTIVITY_TEMPLATE = """\
+📈 RECENT ACTIVITY (24H)
+------------------------------
+Messages: {total_messages:,}
+Delivered: {delivered:,}
+Failed: {failed:,}
+Success Rate: {success_rate:.1%}
+
+"""
+
+ALERT_TEMPLATE = "[{time}] {type}: {message}"
+
 class AgentMonitor:
     """Real-time monitoring for the OTP Agent."""
     
@@ -23,60 +71,142 @@ class AgentMonitor:
             'queue_size': 100,    # Alert if queue >100 messages
             'response_time': 5.0  # Alert if avg response time >5s
         }
-        self.alerts = []
-        self.historical_data = []
+        self.alerts = deque(maxlen=100)  # Keep last 100 alerts
+        # Keep only last 24 hours of data (assuming 30-second intervals)
+        self.historical_data = deque(maxlen=24 * 60 * 2)  # 2880 entries
+        # Epoch timestamps kept in step with the deques above; both are
+        # appended in time order, so they can be searched with bisect
+        self._alert_ts = deque(maxlen=self.alerts.maxlen)
+        self._hist_ts = deque(maxlen=self.historical_data.maxlen)
+        self._ro_conn = None
+        self._current_interval = update_interval
+        self._monitor_thread = None
+        self._stop_event = threading.Event()  # Wakes the loop out of its wait on stop
+        self._ensure_indexes()
+    
+    def _ensure_indexes(self):
+        """Create the indexes the per-tick metric queries rely on.
+        
+        The messages queries use idx_messages_created_status and
+        idx_messages_status, both created by the agent's init_database.
+        """
+        try:
+            with sqlite3.connect(self.agent.db_path) as conn:
+                # WAL is persistent and lets monitor reads run alongside agent writes;
+                # it has to be switched on from a writable connection
+                conn.execute('PRAGMA journal_mode=WAL')
+                # No tick query reads it; it only added write cost to every delivery
+                conn.execute('DROP INDEX IF EXISTS idx_messages_delivered_created')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_otps_expiry ON otps(expiry)')
+                # SQLite only picks up new indexes reliably once statistics exist
+                conn.execute('ANALYZE')
+        except Exception as e:
+            print(f"Error creating monitor indexes: {e}")
+    
+    def _open_ro_conn(self) -> sqlite3.Connection:
+        """Open a read-only connection to the agent database.
+        
+        Rows come back as plain tuples (no row_factory) and no type detection
+        is done, so the TEXT timestamps are never parsed on the Python side.
+        """
+        conn = sqlite3.connect(
+            f'file:{self.agent.db_path}?mode=ro',
+            uri=True,
+            check_same_thread=False,
+            isolation_level=None
+        )
+        conn.execute('PRAGMA query_only=1')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')
+        return conn
     
     def start_monitoring(self):
         """Start the monitoring process."""
+        self._ro_conn = self._open_ro_conn()
         self.monitoring = True
-        monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
-        monitor_thread.start()
+        self._stop_event.clear()
+        self._monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
+        self._monitor_thread.start()
         print("📊 Agent monitoring started")
     
     def stop_monitoring(self):
         """Stop the monitoring process."""
         self.monitoring = False
+        self._stop_event.set()
+        # Let the current tick finish before its connection goes away
+        if self._monitor_thread and self._monitor_thread is not threading.current_thread():
+            self._monitor_thread.join()
+        self._monitor_thread = None
+        if self._ro_conn:
+            self._ro_conn.close()
+            self._ro_conn = None
         print("⏹️ Agent monitoring stopped")
     
     def _monitor_loop(self):
         """Main monitoring loop."""
+        last_activity = None
+        self._current_interval = self.update_interval
+        
         while self.monitoring:
             try:
-                metrics = self._collect_metrics()
-                self._check_alerts(metrics)
-                self._store_historical_data(metrics)
-                self._display_dashboard(metrics)
-                time.sleep(self.update_interval)
+                # One clock reading per tick, shared by every stage below
+                now = datetime.now()
+                metrics = self._collect_metrics(now)
+                
+                # Back off only while the agent is idle: nothing sent since the last
+                # tick and nothing waiting, so a stalled agent with a growing queue
+                # stays on the base interval
+                runtime = metrics['runtime_metrics']
+                activity = (runtime['total_sent'], runtime['total_failed'])
+                waiting = metrics['queue_size'] or metrics['database_metrics'].get('pending_messages', 0)
+                if activity == last_activity and not waiting:
+                    self._current_interval = min(self._current_interval * 2, self.update_interval * 16)
+                else:
+                    self._current_interval = self.update_interval
+                last_activity = activity
+                
+                self._check_alerts(metrics, now)
+                self._store_historical_data(metrics, now)
+                self._display_dashboard(metrics, now)
+                self._stop_event.wait(self._current_interval)
             except Exception as e:
                 print(f"❌ Monitoring error: {e}")
-                time.sleep(self.update_interval)
+                self._stop_event.wait(self.update_interval)
     
-    def _collect_metrics(self) -> Dict[str, Any]:
-        """Collect current metrics from the agent."""
+    def _collect_metrics(self, now: Optional[datetime] = None,
+                         db_metrics: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Collect current metrics from the agent.
+        
+        ``db_metrics`` lets a caller that already ran the database queries for
+        this tick (see run_many) pass them in instead of querying again.
+        """
+        if now is None:
+            now = datetime.now()
         base_metrics = self.agent.get_metrics()
         
+        runtime = base_metrics['runtime_metrics']
+        
         # Additional computed metrics
-        total_sent = base_metrics['runtime_metrics']['total_sent']
-        total_failed = base_metrics['runtime_metrics']['total_failed']
+        total_sent = runtime['total_sent']
+        total_failed = runtime['total_failed']
         
         failure_rate = (total_failed / total_sent) if total_sent > 0 else 0
         success_rate = 1 - failure_rate
         
         # Channel performance
-        channel_performance = {}
-        for channel, stats in base_metrics['runtime_metrics']['channel_stats'].items():
-            sent = stats['sent']
-            delivered = stats['delivered']
-            channel_success_rate = (delivered / sent) if sent > 0 else 0
-            channel_performance[channel] = {
-                'success_rate': channel_success_rate,
-                'total_sent': sent,
-                'total_delivered': delivered,
+        channel_performance = {
+            channel: {
+                'success_rate': (stats['delivered'] / stats['sent']) if stats['sent'] > 0 else 0,
+                'total_sent': stats['sent'],
+                'total_delivered': stats['delivered'],
                 'total_failed': stats['failed']
             }
+            for channel, stats in runtime['channel_stats'].items()
+        }
         
         # Database performance metrics
-        db_metrics = self._get_database_metrics()
+        if db_metrics is None:
+            db_metrics = self._collect_all_db_metrics(now)
         
         enhanced_metrics = {
             **base_metrics,
@@ -84,244 +214,300 @@ class AgentMonitor:
                 'failure_rate': failure_rate,
                 'success_rate': success_rate,
                 'channel_performance': channel_performance,
-                'avg_processing_time': self._get_avg_processing_time(),
-                'messages_per_minute': self._get_messages_per_minute()
+                'avg_processing_time': db_metrics['avg_processing_time'],
+                'messages_per_minute': db_metrics['messages_per_minute']
             },
-            'database_metrics': db_metrics,
-            'timestamp': datetime.now().isoformat()
+            'database_metrics': db_metrics['database_metrics'],
+            'timestamp': now.isoformat()
         }
         
         return enhanced_metrics
     
-    def _get_database_metrics(self) -> Dict[str, Any]:
-        """Get database performance metrics."""
+    def _collect_all_db_metrics(self, now: datetime,
+                                conn: Optional[sqlite3.Connection] = None) -> Dict[str, Any]:
+        """Get all database metrics for a tick in a single pass over each table."""
+        if conn is None and threading.current_thread() is self._monitor_thread:
+            # _ro_conn belongs to the monitor thread; it is never shared with callers on other threads
+            conn = self._ro_conn
         try:
-            with sqlite3.connect(self.agent.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Recent activity (last 24 hours)
-                since = datetime.now() - timedelta(hours=24)
-                
-                cursor.execute('''
-                    SELECT COUNT(*) FROM messages 
-                    WHERE created_at > ?
-                ''', (since,))
-                recent_messages = cursor.fetchone()[0]
-                
-                cursor.execute('''
-                    SELECT COUNT(*) FROM messages 
-                    WHERE created_at > ? AND status = 'delivered'
-                ''', (since,))
-                recent_delivered = cursor.fetchone()[0]
-                
-                cursor.execute('''
-                    SELECT COUNT(*) FROM messages 
-                    WHERE created_at > ? AND status = 'failed'
-                ''', (since,))
-                recent_failed = cursor.fetchone()[0]
-                
-                # Pending messages
-                cursor.execute('''
-                    SELECT COUNT(*) FROM messages 
-                    WHERE status = 'pending'
-                ''')
-                pending_messages = cursor.fetchone()[0]
-                
-                # Active OTPs
-                cursor.execute('''
-                    SELECT COUNT(*) FROM otps 
-                    WHERE expiry > ?
-                ''', (datetime.now(),))
-                active_otps = cursor.fetchone()[0]
-                
-                return {
+            if conn is not None:
+                m24, d24, f24, pend, m5c, avg_s, active_otps = self._query_db_metrics(conn, now)
+            else:
+                # Off the monitor thread (e.g. export_metrics) use a short-lived connection
+                with closing(self._open_ro_conn()) as conn:
+                    m24, d24, f24, pend, m5c, avg_s, active_otps = self._query_db_metrics(conn, now)
+            
+            # SUM() yields NULL on an empty table
+            recent_messages = m24 or 0
+            recent_delivered = d24 or 0
+            
+            return {
+                'database_metrics': {
                     'recent_24h': {
                         'total_messages': recent_messages,
                         'delivered': recent_delivered,
-                        'failed': recent_failed,
+                        'failed': f24 or 0,
                         'success_rate': (recent_delivered / recent_messages) if recent_messages > 0 else 0
                     },
-                    'pending_messages': pending_messages,
+                    'pending_messages': pend or 0,
                     'active_otps': active_otps
-                }
+                },
+                'avg_processing_time': avg_s or 0.0,
+                'messages_per_minute': (m5c or 0) / 5.0  # Average per minute over last 5 minutes
+            }
                 
         except Exception as e:
             print(f"Error getting database metrics: {e}")
-            return {}
+            return {'database_metrics': {}, 'avg_processing_time': 0.0, 'messages_per_minute': 0.0}
     
-    def _get_avg_processing_time(self) -> float:
-        """Calculate average message processing time."""
-        try:
-            with sqlite3.connect(self.agent.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT AVG(
-                        (julianday(delivered_at) - julianday(created_at)) * 24 * 60 * 60
-                    ) as avg_seconds
-                    FROM messages 
-                    WHERE delivered_at IS NOT NULL 
-                    AND created_at > ?
-                ''', (datetime.now() - timedelta(hours=1),))
-                
-                result = cursor.fetchone()[0]
-                return result if result else 0.0
-                
-        except Exception:
-            return 0.0
-    
-    def _get_messages_per_minute(self) -> float:
-        """Calculate current messages per minute rate."""
-        try:
-            with sqlite3.connect(self.agent.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT COUNT(*) FROM messages 
-                    WHERE created_at > ?
-                ''', (datetime.now() - timedelta(minutes=5),))
-                
-                count = cursor.fetchone()[0]
-                return count / 5.0  # Average per minute over last 5 minutes
-                
-        except Exception:
-            return 0.0
+    def _query_db_metrics(self, conn: sqlite3.Connection, now: datetime) -> tuple:
+        """Run the per-tick aggregate queries on the given connection."""
+        # Timestamps are stored as text in the sqlite3 adapter's format, so bind
+        # matching strings and the comparisons stay plain text range scans
+        params = {
+            'h24': (now - timedelta(hours=24)).isoformat(sep=' '),
+            'h1': (now - timedelta(hours=1)).isoformat(sep=' '),
+            'm5': (now - timedelta(minutes=5)).isoformat(sep=' '),
+        }
+        
+        row = conn.execute('''
+            SELECT
+                SUM(CASE WHEN created_at > :h24 THEN 1 ELSE 0 END) AS m24,
+                SUM(CASE WHEN created_at > :h24 AND status = 'delivered' THEN 1 ELSE 0 END) AS d24,
+                SUM(CASE WHEN created_at > :h24 AND status = 'failed' THEN 1 ELSE 0 END) AS f24,
+                SUM(CASE WHEN created_at > :m5 THEN 1 ELSE 0 END) AS m5c
+            FROM messages
+            WHERE created_at > :h24
+        ''', params).fetchone()
+        m24, d24, f24, m5c = row
+        
+        # Only the last hour needs delivered_at, so only its rows are read from
+        # the table; the 24h counts above stay on idx_messages_created_status
+        (avg_s,) = conn.execute('''
+            SELECT AVG((julianday(delivered_at) - julianday(created_at)) * 24 * 60 * 60)
+            FROM messages
+            WHERE created_at > :h1 AND delivered_at IS NOT NULL
+        ''', params).fetchone()
+        
+        # Pending counted on its own: an OR with the window above makes the
+        # planner fall back to a full table scan once statistics exist
+        (pend,) = conn.execute(
+            "SELECT COUNT(*) FROM messages WHERE status = 'pending'"
+        ).fetchone()
+        
+        # Active OTPs
+        (active_otps,) = conn.execute('''
+            SELECT COUNT(*) FROM otps 
+            WHERE expiry > ?
+        ''', (now.isoformat(sep=' '),)).fetchone()
+        
+        return m24, d24, f24, pend, m5c, avg_s, active_otps
     
-    def _check_alerts(self, metrics: Dict[str, Any]):
-        """Check for alert conditions."""
-        current_time = datetime.now()
+    def _check_alerts(self, metrics: Dict[str, Any], now: datetime):
+        """Check for alert conditions.
+        
+        Set a threshold to ``float('inf')`` (or 1.0 for the failure rate) to
+        disable its check.
+        """
+        current_iso = now.isoformat()
+        current_epoch = now.timestamp()
+        thresholds = self.alert_thresholds
         
         # Failure rate alert
-        failure_rate = metrics['computed_metrics']['failure_rate']
-        if failure_rate > self.alert_thresholds['failure_rate']:
-            alert = {
-                'type': 'HIGH_FAILURE_RATE',
-                'message': f'Failure rate {failure_rate:.1%} exceeds threshold {self.alert_thresholds["failure_rate"]:.1%}',
-                'severity': 'HIGH',
-                'timestamp': current_time.isoformat(),
-                'value': failure_rate
-            }
-            self.alerts.append(alert)
-            print(f"🚨 ALERT: {alert['message']}")
+        if thresholds['failure_rate'] < 1.0:
+            failure_rate = metrics['computed_metrics']['failure_rate']
+            if failure_rate > thresholds['failure_rate']:
+                self._emit_alert(
+                    'HIGH_FAILURE_RATE',
+                    f'Failure rate {failure_rate:.1%} exceeds threshold {thresholds["failure_rate"]:.1%}',
+                    'HIGH', failure_rate, current_iso, current_epoch
+                )
         
         # Queue size alert
-        queue_size = metrics['queue_size']
-        if queue_size > self.alert_thresholds['queue_size']:
-            alert = {
-                'type': 'HIGH_QUEUE_SIZE',
-                'message': f'Queue size {queue_size} exceeds threshold {self.alert_thresholds["queue_size"]}',
-                'severity': 'MEDIUM',
-                'timestamp': current_time.isoformat(),
-                'value': queue_size
-            }
-            self.alerts.append(alert)
-            print(f"⚠️  ALERT: {alert['message']}")
+        if math.isfinite(thresholds['queue_size']):
+            queue_size = metrics['queue_size']
+            if queue_size > thresholds['queue_size']:
+                self._emit_alert(
+                    'HIGH_QUEUE_SIZE',
+                    f'Queue size {queue_size} exceeds threshold {thresholds["queue_size"]}',
+                    'MEDIUM', queue_size, current_iso, current_epoch
+                )
         
         # Processing time alert
-        avg_time = metrics['computed_metrics']['avg_processing_time']
-        if avg_time > self.alert_thresholds['response_time']:
-            alert = {
-                'type': 'SLOW_PROCESSING',
-                'message': f'Average processing time {avg_time:.1f}s exceeds threshold {self.alert_thresholds["response_time"]}s',
-                'severity': 'MEDIUM',
-                'timestamp': current_time.isoformat(),
-                'value': avg_time
-            }
-            self.alerts.append(alert)
-            print(f"⚠️  ALERT: {alert['message']}")
-        
-        # Clean old alerts (keep last 100)
-        if len(self.alerts) > 100:
-            self.alerts = self.alerts[-100:]
+        if math.isfinite(thresholds['response_time']):
+            avg_time = metrics['computed_metrics']['avg_processing_time']
+            if avg_time > thresholds['response_time']:
+                self._emit_alert(
+                    'SLOW_PROCESSING',
+                    f'Average processing time {avg_time:.1f}s exceeds threshold {thresholds["response_time"]}s',
+                    'MEDIUM', avg_time, current_iso, current_epoch
+                )
+    
+    def _emit_alert(self, alert_type: str, message: str, severity: str, value: float,
+                    timestamp: str, epoch: float):
+        """Record an alert and echo it to the console."""
+        self.alerts.append({
+            'type': alert_type,
+            'message': message,
+            'severity': severity,
+            'timestamp': timestamp,
+            'value': value
+        })
+        self._alert_ts.append(epoch)
+        icon = "🚨" if severity == 'HIGH' else "⚠️ "
+        print(f"{icon} ALERT: {message}")
     
-    def _store_historical_data(self, metrics: Dict[str, Any]):
+    def _store_historical_data(self, metrics: Dict[str, Any], now: datetime):
         """Store metrics for historical analysis."""
         self.historical_data.append(metrics)
-        
-        # Keep only last 24 hours of data (assuming 30-second intervals)
-        max_entries = 24 * 60 * 2  # 2880 entries
-        if len(self.historical_data) > max_entries:
-            self.historical_data = self.historical_data[-max_entries:]
+        self._hist_ts.append(now.timestamp())
     
-    def _display_dashboard(self, metrics: Dict[str, Any]):
+    def _display_dashboard(self, metrics: Dict[str, Any], now: datetime):
         """Display the monitoring dashboard."""
-        # Clear screen (works on most terminals)
-        print('\033[2J\033[H')
-        
-        print("🤖 INTELLIGENT OTP AGENT - MONITORING DASHBOARD")
-        print("=" * 60)
-        print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        print(f"🟢 Agent Status: {'RUNNING' if self.agent.is_running else 'STOPPED'}")
-        print()
-        
-        # Core metrics
+        self._render(self._build_dashboard(metrics, now))
+    
+    def _build_dashboard(self, metrics: Dict[str, Any], now: datetime) -> List[str]:
+        """Format the dashboard as a list of lines."""
         runtime = metrics['runtime_metrics']
         computed = metrics['computed_metrics']
-        db_stats = metrics['database_stats']
-        
-        print("📊 CORE METRICS")
-        print("-" * 30)
-        print(f"Total Messages Sent: {runtime['total_sent']:,}")
-        print(f"Total Delivered: {runtime['total_delivered']:,}")
-        print(f"Total Failed: {runtime['total_failed']:,}")
-        print(f"Success Rate: {computed['success_rate']:.1%}")
-        print(f"Queue Size: {metrics['queue_size']}")
-        print(f"Avg Processing Time: {computed['avg_processing_time']:.2f}s")
-        print(f"Messages/Minute: {computed['messages_per_minute']:.1f}")
-        print()
         
         # Channel performance
-        print("📱 CHANNEL PERFORMANCE")
-        print("-" * 30)
-        for channel, perf in computed['channel_performance'].items():
-            print(f"{channel:10} | Success: {perf['success_rate']:.1%} | Sent: {perf['total_sent']:,}")
-        print()
+        channels = "\n".join(
+            CHANNEL_TEMPLATE.format_map({'channel': channel, **perf})
+            for channel, perf in computed['channel_performance'].items()
+        )
         
         # Recent activity (24h)
+        recent_activity = ""
         if 'database_metrics' in metrics and 'recent_24h' in metrics['database_metrics']:
-            recent = metrics['database_metrics']['recent_24h']
-            print("📈 RECENT ACTIVITY (24H)")
-            print("-" * 30)
-            print(f"Messages: {recent['total_messages']:,}")
-            print(f"Delivered: {recent['delivered']:,}")
-            print(f"Failed: {recent['failed']:,}")
-            print(f"Success Rate: {recent['success_rate']:.1%}")
-            print()
+            recent_activity = RECENT_ACTIVITY_TEMPLATE.format_map(metrics['database_metrics']['recent_24h'])
         
         # Alerts
+        alerts = ""
         if self.alerts:
-            recent_alerts = [a for a in self.alerts 
-                           if datetime.fromisoformat(a['timestamp']) > datetime.now() - timedelta(hours=1)]
-            if recent_alerts:
-                print("🚨 RECENT ALERTS (1H)")
-                print("-" * 30)
-                for alert in recent_alerts[-5:]:  # Show last 5 alerts
-                    time_str = datetime.fromisoformat(alert['timestamp']).strftime('%H:%M:%S')
-                    print(f"[{time_str}] {alert['type']}: {alert['message']}")
-                print()
+            cutoff = now.timestamp() - 3600
+            first_recent = bisect.bisect_right(self._alert_ts, cutoff)
+            if first_recent < len(self.alerts):
+                start = max(first_recent, len(self.alerts) - 5)  # Show last 5 alerts
+                alert_lines = [
+                    ALERT_TEMPLATE.format(time=datetime.fromtimestamp(ts).strftime('%H:%M:%S'), **alert)
+                    for ts, alert in islice(zip(self._alert_ts, self.alerts), start, None)
+                ]
+                alerts = "🚨 RECENT ALERTS (1H)\n" + "-" * 30 + "\n" + "\n".join(alert_lines) + "\n\n"
+        
+        dashboard = DASHBOARD_TEMPLATE.format_map({
+            'now': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'status': 'RUNNING' if self.agent.is_running else 'STOPPED',
+            'total_sent': runtime['total_sent'],
+            'total_delivered': runtime['total_delivered'],
+            'total_failed': runtime['total_failed'],
+            'success_rate': computed['success_rate'],
+            'queue_size': metrics['queue_size'],
+            'avg_processing_time': computed['avg_processing_time'],
+            'messages_per_minute': computed['messages_per_minute'],
+            'channels': channels,
+            'recent_activity': recent_activity,
+            'alerts': alerts,
+            'interval': self._current_interval
+        })
+        
+        return dashboard.split("\n")
+    
+    @classmethod
+    def run_many(cls, monitors: List['AgentMonitor'], interval: int = 30) -> threading.Thread:
+        """Monitor several agents from a single thread on one cadence.
+        
+        Monitors whose agents share a database file also share one read-only
+        connection and one set of database queries per tick. Call
+        stop_monitoring() on the monitors to end the loop.
+        """
+        for monitor in monitors:
+            monitor.monitoring = True
+            monitor._stop_event.clear()
+            monitor._current_interval = interval
         
-        print(f"🔄 Next update in {self.update_interval} seconds...")
+        thread = threading.Thread(target=cls._run_many_loop, args=(monitors, interval), daemon=True)
+        thread.start()
+        print(f"📊 Monitoring {len(monitors)} agents")
+        return thread
+    
+    @staticmethod
+    def _run_many_loop(monitors: List['AgentMonitor'], interval: int):
+        """Shared monitoring loop behind run_many."""
+        conns = {}
+        try:
+            while True:
+                active = [monitor for monitor in monitors if monitor.monitoring]
+                if not active:
+                    break
+                
+                try:
+                    now = datetime.now()
+                    db_metrics = {}
+                    lines = []
+                    for monitor in active:
+                        db_path = monitor.agent.db_path
+                        if db_path not in db_metrics:
+                            if db_path not in conns:
+                                conns[db_path] = monitor._open_ro_conn()
+                            db_metrics[db_path] = monitor._collect_all_db_metrics(now, conns[db_path])
+                        
+                        metrics = monitor._collect_metrics(now, db_metrics[db_path])
+                        monitor._check_alerts(metrics, now)
+                        monitor._store_historical_data(metrics, now)
+                        lines.extend(monitor._build_dashboard(metrics, now))
+                        lines.append("")
+                    
+                    # Stack every dashboard into one frame
+                    active[0]._render(lines)
+                except Exception as e:
+                    print(f"❌ Monitoring error: {e}")
+                
+                # Stopping the first active monitor ends the wait early
+                active[0]._stop_event.wait(interval)
+        finally:
+            for conn in conns.values():
+                conn.close()
+    
+    def _render(self, lines: List[str]):
+        """Redraw the dashboard as one full frame.
+        
+        Clearing and rewriting everything each tick stays correct when alerts
+        or agent logging have scrolled the terminal since the last frame.
+        """
+        sys.stdout.write('\033[H\033[J' + '\n'.join(lines) + '\n')
+        sys.stdout.flush()
     
     def get_historical_data(self, hours: int = 1) -> List[Dict[str, Any]]:
         """Get historical data for the specified time period."""
-        cutoff = datetime.now() - timedelta(hours=hours)
-        return [
-            data for data in self.historical_data
-            if datetime.fromisoformat(data['timestamp']) > cutoff
-        ]
+        cutoff = time.time() - hours * 3600
+        first = bisect.bisect_right(self._hist_ts, cutoff)
+        return list(islice(self.historical_data, first, None))
+    
+    @staticmethod
+    def _tail(entries: deque, count: int) -> List[Dict[str, Any]]:
+        """Return the last ``count`` entries of a deque as a list."""
+        return list(islice(entries, max(len(entries) - count, 0), None))
     
     def export_metrics(self, filename: str = None) -> str:
         """Export current metrics to JSON file."""
+        now = datetime.now()
         if not filename:
-            filename = f"agent_metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+            filename = f"agent_metrics_{now.strftime('%Y%m%d_%H%M%S')}.json"
         
         export_data = {
-            'export_timestamp': datetime.now().isoformat(),
-            'current_metrics': self._collect_metrics(),
-            'recent_alerts': self.alerts[-50:],  # Last 50 alerts
-            'historical_data': self.historical_data[-100:]  # Last 100 data points
+            'export_timestamp': now.isoformat(),
+            'current_metrics': self._collect_metrics(now),
+            'recent_alerts': self._tail(self.alerts, 50),  # Last 50 alerts
+            'historical_data': self._tail(self.historical_data, 100)  # Last 100 data points
         }
         
-        with open(filename, 'w') as f:
-            json.dump(export_data, f, indent=2)
+        if orjson is not None:
+            with open(filename, 'wb') as f:
+                f.write(orjson.dumps(export_data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(filename, 'w') as f:
+                json.dump(export_data, f, indent=2)
         
         print(f"📁 Metrics exported to {filename}")
         return filename
@@ -7,70 +7,112 @@ This script shows you all the different ways to run the agent
 """
 
 import os
-import subprocess
 import sys
 
+SCRIPTS = {
+    "1": "api_server.py",
+    "2": "automation.py", 
+    "3": "otp_messaging_agent.py",
+    "4": "demo_your_data.py",
+    "5": "monitor.py",
+    "6": "enterprise_demo.py",
+    "7": "test_api.py"
+}
+
+# Static text, each written in one call
+_MENU = """\
+🤖 INTELLIGENT OTP AGENT - HOW TO RUN
+==================================================
+
+Choose how you want to run the agent:
+
+1️⃣  REST API Server (for web integration)
+   python api_server.py
+   → Starts HTTP server on localhost:5000
+   → Use with curl, Postman, or web apps
+
+2️⃣  Full Automation (file monitoring + scheduled tasks)
+   python automation.py
+   → Monitors data/incoming/ for JSON/CSV files
+   → Automatic cleanup and maintenance
+   → Background processing
+
+3️⃣  Interactive Demo
+   python otp_messaging_agent.py
+   → Shows all features with examples
+   → Demonstrates AI routing and processing
+
+4️⃣  Process Your Data (what we just did)
+   python demo_your_data.py
+   → Processes your auto_messages.json
+   → Shows real-time results
+
+5️⃣  Real-time Monitoring
+   python monitor.py
+   → Live dashboard with metrics
+   → Performance monitoring
+
+6️⃣  Enterprise Integration Examples
+   python enterprise_demo.py
+   → Simulates real business integrations
+   → Shows automated workflows
+
+7️⃣  Test API Endpoints
+   python test_api.py
+   → Tests all REST API functions
+   → Requires API server to be running
+
+"""
+
+_QUICK_START = """\
+
+==================================================
+📋 QUICK START RECOMMENDATIONS:
+
+🆕 New user? Start with: python otp_messaging_agent.py
+🌐 Want API access? Run: python api_server.py
+📁 Have data files? Use: python automation.py
+📊 Want monitoring? Try: python monitor.py
+
+"""
+
 def show_options():
-    print("🤖 INTELLIGENT OTP AGENT - HOW TO RUN")
-    print("=" * 50)
-    print()
-    print("Choose how you want to run the agent:")
-    print()
-    print("1️⃣  REST API Server (for web integration)")
-    print("   python api_server.py")
-    print("   → Starts HTTP server on localhost:5000")
-    print("   → Use with curl, Postman, or web apps")
-    print()
-    print("2️⃣  Full Automation (file monitoring + scheduled tasks)")
-    print("   python automation.py")
-    print("   → Monitors data/incoming/ for JSON/CSV files")
-    print("   → Automatic cleanup and maintenance")
-    print("   → Background processing")
-    print()
-    print("3️⃣  Interactive Demo")
-    print("   python otp_messaging_agent.py")
-    print("   → Shows all features with examples")
-    print("   → Demonstrates AI routing and processing")
-    print()
-    print("4️⃣  Process Your Data (what we just did)")
-    print("   python demo_your_data.py")
-    print("   → Processes your auto_messages.json")
-    print("   → Shows real-time results")
-    print()
-    print("5️⃣  Real-time Monitoring")
-    print("   python monitor.py")
-    print("   → Live dashboard with metrics")
-    print("   → Performance monitoring")
-    print()
-    print("6️⃣  Enterprise Integration Examples")
-    print("   python enterprise_demo.py")
-    print("   → Simulates real business integrations")
-    print("   → Shows automated workflows")
-    print()
-    print("7️⃣  Test API Endpoints")
-    print("   python test_api.py")
-    print("   → Tests all REST API functions")
-    print("   → Requires API server to be running")
-    print()
-
-def run_choice(choice):
-    scripts = {
-        "1": "api_server.py",
-        "2": "automation.py", 
-        "3": "otp_messaging_agent.py",
-        "4": "demo_your_data.py",
-        "5": "monitor.py",
-        "6": "enterprise_demo.py",
-        "7": "test_api.py"
-    }
+    sys.stdout.write(_MENU)
+    sys.stdout.flush()
+
+def _dir_names(path):
+    """Names of the entries in a directory, or an empty set if it doesn't exist."""
+    try:
+        with os.scandir(path) as entries:
+            return {entry.name for entry in entries}
+    except OSError:
+        return set()
+
+def run_choice(choice, replace_process=False):
+    """Run the chosen script.
     
-    if choice in scripts:
-        script = scripts[choice]
+    With replace_process the script takes over this process via os.execvp,
+    so there is no idle parent waiting on a child, but run_choice never
+    returns. The interactive menu leaves it off so it can come back to the
+    prompt once the script exits.
+    """
+    if choice in SCRIPTS:
+        script = SCRIPTS[choice]
         print(f"\n🚀 Running: python {script}")
         print("=" * 50)
         
+        if replace_process:
+            # Flush first: exec discards anything still buffered
+            sys.stdout.flush()
+            try:
+                os.execvp(sys.executable, [sys.executable, script])
+            except OSError as e:
+                print(f"⚠️  Could not exec {script} ({e}), running it as a child instead")
+        
+        import subprocess  # Deferred: the exec path never needs it
+        
         try:
-            subprocess.run([sys.executable, script], check=True)
+            subprocess.run([sys.executable, script], check=True, close_fds=True)
         except KeyboardInterrupt:
             print(f"\n⏹️  Stopped {script}")
         except subprocess.CalledProcessError as e:
@@ -79,22 +121,29 @@ def run_choice(choice):
         print("❌ Invalid choice!")
 
 if __name__ == "__main__":
+    # Non-interactive: hand the process straight to the chosen script
+    if len(sys.argv) > 1:
+        import argparse  # Only the command-line path needs it
+        
+        parser = argparse.ArgumentParser(description="Run one of the Intelligent OTP Agent scripts")
+        parser.add_argument("choice", choices=list(SCRIPTS),
+                            help="script number to run straight away (omit for the interactive menu)")
+        args = parser.parse_args()
+        run_choice(args.choice, replace_process=True)
+        sys.exit(0)
+    
     show_options()
     
-    print("\n" + "="*50)
-    print("📋 QUICK START RECOMMENDATIONS:")
-    print()
-    print("🆕 New user? Start with: python otp_messaging_agent.py")
-    print("🌐 Want API access? Run: python api_server.py")
-    print("📁 Have data files? Use: python automation.py")
-    print("📊 Want monitoring? Try: python monitor.py")
-    print()
+    sys.stdout.write(_QUICK_START)
+    
+    # Show current status (one directory listing each, checked once up front)
+    incoming = _dir_names("data/incoming")
+    here = _dir_names(".")
     
-    # Show current status
-    if os.path.exists("data/incoming/auto_messages.json"):
+    if "auto_messages.json" in incoming:
         print("✅ Your auto_messages.json is ready for processing!")
     
-    if os.path.exists("otp_agent.db"):
+    if "otp_agent.db" in here:
         print("✅ Database exists with previous messages")
     
     print("\n💡 TIP: You can run multiple scripts simultaneously!")
@@ -6,9 +6,37 @@ Run this to get started quickly!
 
 import subprocess
 import sys
+import threading
 import time
 import os
 
+# Closing instructions, written in one call
+_WHATS_NEXT = """\
+
+==================================================
+🎯 WHAT'S NEXT?
+
+1️⃣  Start API Server for real-time integration:
+   python api_server.py
+   Then visit: http://localhost:5000/health
+
+2️⃣  Add more messages to process:
+   Edit: data/incoming/auto_messages.json
+   Or create new JSON files in data/incoming/
+
+3️⃣  Start full automation (monitors files automatically):
+   python automation.py
+
+4️⃣  See live monitoring dashboard:
+   python monitor.py
+
+📖 For complete documentation, see:
+   - README.md
+   - AUTOMATION_GUIDE.md
+
+💡 Your agent is ready to use! 🎉
+"""
+
 def main():
     print("🚀 INTELLIGENT OTP AGENT - QUICK START")
     print("=" * 50)
@@ -27,40 +55,35 @@ def main():
         # Process it immediately
         print("\n📥 Processing your auto_messages.json...")
         try:
-            result = subprocess.run([sys.executable, "demo_your_data.py"], 
-                                  capture_output=True, text=True, timeout=30)
-            print("✅ Your messages have been processed!")
-            if result.stdout:
+            # Stream the demo's output line by line instead of buffering it all
+            # (-u so the child's prints reach us as they happen, not at exit)
+            proc = subprocess.Popen([sys.executable, "-u", "demo_your_data.py"],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    text=True, bufsize=1)
+            # Kill the demo if it outlives the timeout; that also ends the read loop
+            timed_out = threading.Event()
+            watchdog = threading.Timer(30, lambda: (timed_out.set(), proc.kill()))
+            watchdog.start()
+            try:
                 print("📊 Results:")
-                # Extract key info from output
-                for line in result.stdout.split('\n'):
+                # Extract key info from output as it arrives
+                for line in proc.stdout:
                     if 'Loaded' in line or 'sent' in line or 'Success' in line or 'Message' in line:
-                        print(f"   {line}")
+                        print(f"   {line.rstrip()}")
+                proc.wait()
+            finally:
+                watchdog.cancel()
+                proc.stdout.close()
+            
+            if timed_out.is_set():
+                print("❌ Error processing: demo_your_data.py timed out after 30 seconds")
+            else:
+                print("✅ Your messages have been processed!")
         except Exception as e:
             print(f"❌ Error processing: {e}")
     
-    print("\n" + "="*50)
-    print("🎯 WHAT'S NEXT?")
-    print()
-    print("1️⃣  Start API Server for real-time integration:")
-    print("   python api_server.py")
-    print("   Then visit: http://localhost:5000/health")
-    print()
-    print("2️⃣  Add more messages to process:")
-    print("   Edit: data/incoming/auto_messages.json")
-    print("   Or create new JSON files in data/incoming/")
-    print()
-    print("3️⃣  Start full automation (monitors files automatically):")
-    print("   python automation.py")
-    print()
-    print("4️⃣  See live monitoring dashboard:")
-    print("   python monitor.py")
-    print()
-    print("📖 For complete documentation, see:")
-    print("   - README.md")
-    print("   - AUTOMATION_GUIDE.md")
-    print()
-    print("💡 Your agent is ready to use! 🎉")
+    sys.stdout.write(_WHATS_NEXT)
+    sys.stdout.flush()
 
 if __name__ == "__main__":
     main()
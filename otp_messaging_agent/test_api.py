@@ -1,92 +1,129 @@
 # Test script for the Intelligent OTP Agent API
 # Demonstrates automated message processing via REST API
 
-import requests
+import asyncio
 import json
-import time
+import sys
+
+try:
+    import aiohttp  # Required: the test driver's HTTP client
+except ImportError:
+    print("❌ test_api.py needs aiohttp. Install it with: pip install aiohttp")
+    sys.exit(1)
+
+try:
+    import orjson  # Optional: faster request/response JSON
+except ImportError:
+    orjson = None
+
+def json_dumps(obj):
+    """Serialize a request body, with orjson when it's installed."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+json_loads = orjson.loads if orjson is not None else json.loads
 
 BASE_URL = "http://localhost:5000"
 
-def test_send_otp():
-    """Test sending an OTP via API."""
-    print("📱 Testing OTP sending...")
-    
-    data = {
+# The message /send-otp is tested with
+OTP_MESSAGES = [
+    {
         "phone_number": "+447700900001",
+        "message_type": "otp",
+        "priority": "HIGH",
         "user_id": "test_user_001",
         "callback_url": "https://webhook.site/test"
     }
+]
+
+# Bulk and JSON-load messages as compact rows over one field tuple; None
+# leaves a field out so the server applies its default
+FIELDS = ("phone_number", "message_type", "content", "priority", "preferred_channel")
+
+def _messages(rows):
+    """Expand (FIELDS-ordered) rows into the message dicts the API expects."""
+    return [{k: v for k, v in zip(FIELDS, row) if v is not None} for row in rows]
+
+BULK_MESSAGES = _messages([
+    ("+447700900002", "alert", "Security alert: New login detected", "CRITICAL", "SMS"),
+    ("+447700900003", "notification", "Your order has been shipped", "MEDIUM", "WhatsApp"),
+    ("+447700900004", "otp", None, "HIGH", None),
+])
+
+JSON_MESSAGES = _messages([
+    ("+447700900005", "welcome", "Welcome to our platform!", "LOW", "Email"),
+    ("+447700900006", "reminder", "Don't forget your appointment tomorrow", "MEDIUM", None),
+])
+
+ALL_MESSAGES = OTP_MESSAGES + BULK_MESSAGES + JSON_MESSAGES
+
+async def wait_until(predicate, timeout=5.0, initial=0.005, max_step=0.1):
+    """Poll an async predicate with exponential backoff until it holds or time runs out."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    step = initial
+    while True:
+        if await predicate():
+            return True
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(step, remaining))
+        step = min(max_step, step * 2)
+
+async def total_sent(session):
+    """Messages the agent has finished sending so far."""
+    async with session.get("/metrics") as response:
+        metrics = await response.json(loads=json_loads)
+    return metrics["runtime_metrics"]["total_sent"]
+
+async def api_ready(session):
+    """True once the health endpoint answers."""
+    try:
+        async with session.get("/health") as response:
+            return response.status == 200
+    except aiohttp.ClientConnectionError:
+        return False
+
+async def _reached(session, expected_sent):
+    """True once total_sent has caught up with expected_sent."""
+    return await total_sent(session) >= expected_sent
+
+async def test_send_otp(session):
+    """Test sending an OTP via API."""
+    print("📱 Testing OTP sending...")
     
-    response = requests.post(f"{BASE_URL}/send-otp", json=data)
-    print(f"Response: {response.status_code}")
-    print(f"Data: {response.json()}")
-    return response.json().get("message_id")
+    async with session.post("/send-otp", json=OTP_MESSAGES[0]) as response:
+        print(f"Response: {response.status}")
+        result = await response.json(loads=json_loads)
+    
+    print(f"Data: {result}")
+    return result.get("message_id")
 
-def test_send_bulk():
+async def test_send_bulk(session):
     """Test bulk message sending."""
     print("\n📦 Testing bulk message sending...")
     
-    data = {
-        "messages": [
-            {
-                "phone_number": "+447700900002",
-                "message_type": "alert",
-                "content": "Security alert: New login detected",
-                "priority": "CRITICAL",
-                "preferred_channel": "SMS"
-            },
-            {
-                "phone_number": "+447700900003",
-                "message_type": "notification",
-                "content": "Your order has been shipped",
-                "priority": "MEDIUM",
-                "preferred_channel": "WhatsApp"
-            },
-            {
-                "phone_number": "+447700900004",
-                "message_type": "otp",
-                "priority": "HIGH"
-            }
-        ]
-    }
-    
-    response = requests.post(f"{BASE_URL}/send-bulk", json=data)
-    print(f"Response: {response.status_code}")
-    print(f"Data: {response.json()}")
+    async with session.post("/send-bulk", json={"messages": BULK_MESSAGES}) as response:
+        print(f"Response: {response.status}")
+        print(f"Data: {await response.json(loads=json_loads)}")
 
-def test_load_from_json():
+async def test_load_from_json(session):
     """Test loading messages from JSON data."""
     print("\n📄 Testing JSON data loading...")
     
-    data = {
-        "messages": [
-            {
-                "phone_number": "+447700900005",
-                "message_type": "welcome",
-                "content": "Welcome to our platform!",
-                "priority": "LOW",
-                "preferred_channel": "Email"
-            },
-            {
-                "phone_number": "+447700900006",
-                "message_type": "reminder",
-                "content": "Don't forget your appointment tomorrow",
-                "priority": "MEDIUM"
-            }
-        ]
-    }
-    
-    response = requests.post(f"{BASE_URL}/load-from-json", json=data)
-    print(f"Response: {response.status_code}")
-    print(f"Data: {response.json()}")
+    async with session.post("/load-from-json", json={"messages": JSON_MESSAGES}) as response:
+        print(f"Response: {response.status}")
+        print(f"Data: {await response.json(loads=json_loads)}")
 
-def test_metrics():
+async def test_metrics(session):
     """Test getting agent metrics."""
     print("\n📊 Testing metrics endpoint...")
     
-    response = requests.get(f"{BASE_URL}/metrics")
-    print(f"Response: {response.status_code}")
-    metrics = response.json()
+    async with session.get("/metrics") as response:
+        print(f"Response: {response.status}")
+        metrics = await response.json(loads=json_loads)
     
     print("Current metrics:")
     print(f"  Total sent: {metrics['runtime_metrics']['total_sent']}")
@@ -94,13 +131,12 @@ def test_metrics():
     print(f"  Success rate: {metrics['database_stats']['success_rate']}")
     print(f"  Queue size: {metrics['queue_size']}")
 
-def test_verify_otp():
+async def test_verify_otp(session, message_id):
     """Test OTP verification."""
     print("\n🔐 Testing OTP verification...")
     
-    # First send an OTP
-    message_id = test_send_otp()
-    time.sleep(2)  # Wait for processing
+    # The OTP went out in test_send_otp; no need to send another
+    print(f"OTP message: {message_id}")
     
     # Try to verify with wrong OTP
     data = {
@@ -108,41 +144,56 @@ def test_verify_otp():
         "otp": "123456"
     }
     
-    response = requests.post(f"{BASE_URL}/verify-otp", json=data)
-    print(f"Wrong OTP Response: {response.status_code}")
-    print(f"Data: {response.json()}")
+    async with session.post("/verify-otp", json=data) as response:
+        print(f"Wrong OTP Response: {response.status}")
+        print(f"Data: {await response.json(loads=json_loads)}")
 
-if __name__ == "__main__":
-    print("🤖 Testing Intelligent OTP Agent API")
-    print("=" * 50)
-    
-    # Wait for API to be ready
-    time.sleep(2)
-    
-    try:
+async def main():
+    """Run the API tests."""
+    # One session for every call; its keep-alive pool is reused across tests and
+    # localhost is resolved once per run instead of once per connection
+    connector = aiohttp.TCPConnector(limit=32, keepalive_timeout=30, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(base_url=BASE_URL, connector=connector,
+                                     json_serialize=json_dumps) as session:
+        # Wait for API to be ready
+        await wait_until(lambda: api_ready(session))
+        
         # Test health
-        response = requests.get(f"{BASE_URL}/health")
-        if response.status_code == 200:
-            print("✅ API is healthy")
-        else:
-            print("❌ API health check failed")
-            exit(1)
+        async with session.get("/health") as response:
+            if response.status == 200:
+                print("✅ API is healthy")
+            else:
+                print("❌ API health check failed")
+                exit(1)
         
-        # Run tests
-        test_send_otp()
-        test_send_bulk()
-        test_load_from_json()
+        # Run tests (one request per endpoint under test)
+        expected_sent = await total_sent(session) + len(ALL_MESSAGES)
+        otp_message_id = await test_send_otp(session)
+        await test_send_bulk(session)
+        await test_load_from_json(session)
         
-        # Wait for processing
+        # Wait for processing (returns as soon as every message is sent, 5s at most)
         print("\n⏳ Waiting for message processing...")
-        time.sleep(5)
+        await wait_until(lambda: _reached(session, expected_sent))
         
-        test_metrics()
-        test_verify_otp()
+        await test_metrics(session)
+        await test_verify_otp(session, otp_message_id)
         
         print("\n✅ All API tests completed!")
-        
-    except requests.exceptions.ConnectionError:
+
+if __name__ == "__main__":
+    print("🤖 Testing Intelligent OTP Agent API")
+    print("=" * 50)
+    
+    try:
+        # One event loop for the whole suite (asyncio.Runner on 3.11+)
+        if hasattr(asyncio, "Runner"):
+            with asyncio.Runner() as runner:
+                runner.run(main())
+        else:
+            asyncio.run(main())
+    
+    except aiohttp.ClientConnectorError:
         print("❌ Could not connect to API server. Make sure it's running on port 5000")
     except Exception as e:
         print(f"❌ Test error: {e}")